@@ -2,19 +2,42 @@
 """
 Metric exporter that pushes metrics to VictoriaMetrics.
 """
+import functools
+import logging
 import os
 import time
-from datetime import datetime
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import requests
-from prometheus_client import CollectorRegistry, Gauge, generate_latest
+
+from gh_common import (
+    WORKFLOW_FILE,
+    create_session,
+    fetch_all_runs,
+    get_merge_queue_runs_count_by_status,
+)
 
 # Number of runs to backfill on startup
 BACKFILL_COUNT = 10000
 
+# Number of metric lines to send per VictoriaMetrics request
+BATCH_SIZE = 500
+
+# Maximum number of batches pushed to VictoriaMetrics concurrently
+PUSH_CONCURRENCY = 4
+
 # Interval to poll for new runs, in seconds
 POLL_INTERVAL = 300
 
+# File persisting the newest pushed run `updated_at`, in milliseconds since epoch
+CURSOR_FILE = os.getenv("CURSOR_FILE", "last_updated_at")
+
+# How long a run may take between creation and completion, in seconds. Runs
+# are listed newest-created first, so paging stops once runs were created
+# before the cursor minus this window.
+CURSOR_LOOKBACK = 6 * 60 * 60
+
 WORKFLOW_STATUSES = [
     "completed",
     "cancelled",
@@ -26,221 +49,196 @@ WORKFLOW_STATUSES = [
 
 VICTORIAMETRICS_URL = os.getenv("VM_URL")
 
-OWNER = "AztecProtocol"
-REPO = "aztec-packages"
-WORKFLOW_FILE = "ci3.yml"
-GITHUB_API = "https://api.github.com"
+log = logging.getLogger(__name__)
 
 if not VICTORIAMETRICS_URL:
     print("Error: VM_URL environment variable is not set", file=sys.stderr)
     sys.exit(1)
 
 
-def push_metric_to_victoriametrics(
-    timestamp: int,
+VM_SESSION = create_session()
+
+
+def escape_label_value(value: str) -> str:
+    """Escape a label value as required by the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(label_items: tuple[tuple[str, str], ...]) -> str:
+    """Format label pairs as `{k="v",...}`, or an empty string without labels."""
+    if not label_items:
+        return ""
+    label_str = ",".join(f'{k}="{escape_label_value(str(v))}"' for k, v in label_items)
+    return f"{{{label_str}}}"
+
+
+@functools.lru_cache(maxsize=256)
+def make_renderer(
+    metric_name: str,
+    label_items: tuple[tuple[str, str], ...] = (),
+    exemplar_keys: tuple[str, ...] = (),
+) -> Callable[..., str]:
+    """
+    Build a line renderer specialized for one metric, label set and exemplar schema.
+
+    The metric name and labels are formatted once here. The returned function
+    takes (metric_value, timestamp, *exemplar_values) and only formats those.
+    """
+    prefix = f"{metric_name}{format_labels(label_items)}"
+
+    if not exemplar_keys:
+        def render(metric_value: float, timestamp: int) -> str:
+            return f"{prefix} {float(metric_value)} {timestamp}"
+        return render
+
+    exemplar_template = ",".join(f'{k}="{{}}"' for k in exemplar_keys)
+
+    def render_with_exemplar(metric_value: float, timestamp: int, *exemplar_values: str) -> str:
+        return f"{prefix} {float(metric_value)} {timestamp} # {exemplar_template.format(*exemplar_values)}"
+    return render_with_exemplar
+
+
+def render_metric_line(
     metric_name: str,
     metric_value: float,
-    victoriametrics_url: str = VICTORIAMETRICS_URL,
-    exemplar: dict[str, str] | None = None,
+    timestamp: int,
     labels: dict[str, str] | None = None,
-):
+    exemplar: dict[str, str] | None = None,
+) -> str:
     """
-    Push a metric to VictoriaMetrics using the Prometheus remote write format.
+    Render a single sample in the Prometheus text format accepted by VictoriaMetrics.
+
+    Hot loops should hoist make_renderer instead of calling this per sample.
 
     Args:
         metric_name: Name of the metric
         metric_value: Value of the metric
-        victoriametrics_url: Base URL of VictoriaMetrics instance
+        timestamp: Timestamp in milliseconds since epoch.
+        labels: Optional dictionary of labels to add to the metric.
         exemplar: Optional dictionary of exemplar labels (e.g., {"run_id": "12345", "span_id": "def456"})
                   These are attached as exemplars without creating new time series (low cardinality)
-        timestamp: Optional timestamp in milliseconds since epoch. If None, uses current time.
-        labels: Optional dictionary of labels to add to the metric.
     """
-    # Create a registry and gauge metric WITHOUT labels to avoid high cardinality
-    registry = CollectorRegistry()
-    if not labels:
-        labels = {}
-    labelnames = list(labels.keys())
-    gauge = Gauge(
+    exemplar = exemplar or {}
+    render = make_renderer(
         metric_name,
-        f'Workflow runs metric: {metric_name}',
-        labelnames=labelnames,
-        registry=registry
+        tuple(sorted(labels.items())) if labels else (),
+        tuple(exemplar),
     )
-    gauge.labels(*[labels[labelname] for labelname in labelnames]).set(metric_value)
-    # Generate Prometheus format metrics
-    metrics_data = generate_latest(registry)
-
-    # Parse metrics and add timestamps and exemplars to metric value lines
-    lines = metrics_data.decode('utf-8').split('\n')
-    annotated_lines = []
-    for line in lines:
-        # Skip comments and empty lines
-        if line.startswith('#') or not line.strip():
-            annotated_lines.append(line)
-            continue
-
-        # We need to add timestamp and optionally exemplars
-        annotated_line = f"{line} {timestamp}"
-        if exemplar:
-            exemplar_str = ','.join([f'{k}="{v}"' for k, v in exemplar.items()])
-            annotated_line = f"{annotated_line} # {exemplar_str}"
-        annotated_lines.append(annotated_line)
-
-    metrics_data_with_timestamp = '\n'.join(annotated_lines).encode('utf-8')
-    print(f"Metrics data with timestamp: {metrics_data_with_timestamp.decode('utf-8')}")
+    return render(metric_value, timestamp, *exemplar.values())
+
+
+def flush_batch(lines: list[str], victoriametrics_url: str = VICTORIAMETRICS_URL) -> bool:
+    """
+    Push a batch of rendered metric lines to VictoriaMetrics in a single request.
+
+    Args:
+        lines: Lines produced by render_metric_line
+        victoriametrics_url: Base URL of VictoriaMetrics instance
+    """
+    if not lines:
+        return True
+
+    body = "\n".join(lines)
+    log.debug("Metrics data with timestamp: %s", body)
 
     # Push to VictoriaMetrics
     push_url = f"{victoriametrics_url}/api/v1/import/prometheus"
     headers = {'Content-Type': 'application/openmetrics-text'}
 
     try:
-        response = requests.post(push_url, data=metrics_data_with_timestamp, headers=headers, timeout=10)
+        response = VM_SESSION.post(push_url, data=body.encode("utf-8"), headers=headers, timeout=10)
         response.raise_for_status()
-        print(f"Successfully pushed {metric_name}={metric_value} to VictoriaMetrics (timestamp: {timestamp})")
+        log.debug("Successfully pushed %d metrics to VictoriaMetrics", len(lines))
         return True
     except requests.exceptions.RequestException as e:
-        print(f"Error pushing metric to VictoriaMetrics: {e}")
+        log.error("Error pushing metrics to VictoriaMetrics: %s", e)
         return False
 
 
-def get_github_headers():
-    """Get headers for GitHub API requests."""
-    headers = {"Accept": "application/vnd.github+json"}
-    token = os.environ.get("GITHUB_TOKEN")
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-    return headers
+def load_cursor() -> int | None:
+    """Load the persisted `updated_at` cursor, if any."""
+    try:
+        with open(CURSOR_FILE) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
 
 
-def get_merge_queue_runs_count_by_status(status: str = "completed") -> int:
-    """Get the count of merge queue runs by status."""
-    url = f"{GITHUB_API}/repos/{OWNER}/{REPO}/actions/workflows/{WORKFLOW_FILE}/runs"
-    params = {
-        "event": "merge_group",
-        "status": status,
-    }
-    response = requests.get(url, headers=get_github_headers(), params=params)
-    response.raise_for_status()
-    return response.json()["total_count"]
+def save_cursor(cursor: int):
+    """Persist the `updated_at` cursor so restarts do not re-push runs."""
+    tmp_file = f"{CURSOR_FILE}.tmp"
+    try:
+        with open(tmp_file, "w") as f:
+            f.write(str(cursor))
+        os.replace(tmp_file, CURSOR_FILE)
+    except OSError as e:
+        log.error("Error saving cursor to %s: %s", CURSOR_FILE, e)
 
 
-def get_merge_queue_runs(per_page: int = 30, page: int = 1) -> dict:
-    """
-    Fetch workflow runs triggered by merge_group events.
-
-    GitHub API: GET /repos/{owner}/{repo}/actions/workflows/{workflow_id}/runs
-    Docs: https://docs.github.com/en/rest/actions/workflow-runs#list-workflow-runs-for-a-workflow
-    """
-    url = f"{GITHUB_API}/repos/{OWNER}/{REPO}/actions/workflows/{WORKFLOW_FILE}/runs"
-    params = {
-        "event": "merge_group",
-        "status": "completed",
-        "per_page": per_page,
-        "page": page,
-    }
-
-    response = requests.get(url, headers=get_github_headers(), params=params)
-    response.raise_for_status()
-    return response.json()
-
-
-def parse_run_data(run: dict) -> dict:
-    """Extract relevant fields from a workflow run."""
-    created_at = datetime.fromisoformat(run["created_at"].replace("Z", "+00:00"))
-    updated_at = datetime.fromisoformat(run["updated_at"].replace("Z", "+00:00"))
-
-    # Duration is from creation to completion
-    duration_seconds = (updated_at - created_at).total_seconds()
-
-    return {
-        "id": run["id"],
-        "run_number": run["run_number"],
-        "status": run["status"],  # queued, in_progress, completed
-        "conclusion": run["conclusion"],  # success, failure, cancelled, etc.
-        "created_at": created_at,
-        "updated_at": updated_at,
-        "duration_seconds": duration_seconds,
-        "duration_minutes": duration_seconds / 60,
-        "html_url": run["html_url"],
-        "head_branch": run["head_branch"],
-        "head_sha": run["head_sha"][:8],
-    }
-
-
-def fetch_all_runs(max_runs: int = 100) -> list[dict]:
-    """Fetch multiple pages of runs up to max_runs."""
-    page = 1
-    remaining_runs = max_runs
-    per_page = min(100, max_runs)  # GitHub max is 100 per page
-
-    while remaining_runs:
-        data = get_merge_queue_runs(per_page=per_page, page=page)
-        runs = data.get("workflow_runs", [])
-
-        if not runs:
-            break
-
-        for run in runs:
-            if remaining_runs <= 0:
-                break
-            yield parse_run_data(run)
-            remaining_runs -= 1
-
-        page += 1
+# Renders `workflow_runs_duration_seconds` with the run id as exemplar:
+# render_run_duration(duration_seconds, created_at_ms, run_id)
+render_run_duration = make_renderer(
+    "workflow_runs_duration_seconds",
+    (("workflow_file", WORKFLOW_FILE),),
+    ("run_id",),
+)
 
 
 def backfill_runs(count=BACKFILL_COUNT):
-    for run in fetch_all_runs(max_runs=count):
-        timestamp = int(run["created_at"].timestamp() * 1000)
-        metric_value = run["duration_seconds"]
-        run_id = str(run["id"])
-        labels = {"workflow_file": WORKFLOW_FILE}
-        exemplar = {"run_id": run_id}
-        push_metric_to_victoriametrics(
-            timestamp,
-            "workflow_runs_duration_seconds",
-            metric_value,
-            labels=labels,
-            exemplar=exemplar
-        )
+    # Batches are pushed in the background so fetching the next pages from
+    # GitHub is not blocked on VictoriaMetrics round trips.
+    with ThreadPoolExecutor(max_workers=PUSH_CONCURRENCY) as pool:
+        lines = []
+        for run in fetch_all_runs(max_runs=count):
+            lines.append(render_run_duration(run["duration_seconds"], run["created_at"], str(run["id"])))
+            if len(lines) >= BATCH_SIZE:
+                pool.submit(flush_batch, lines)
+                lines = []
+        pool.submit(flush_batch, lines)
 
 
 def push_metrics():
     """Poll for workflow runs and Push metrics to VictoriaMetrics."""
-    processed_runs = set[str]()
+    # Newest `updated_at` already pushed; runs updated at or before it are skipped
+    cursor = load_cursor()
     while True:
         now = int(time.time() * 1000)
-        for status in WORKFLOW_STATUSES:
-            count = get_merge_queue_runs_count_by_status(status=status)
-            print(f"{status} runs: {count}")
+        lines = []
+        # The per-status counts are independent, so fetch them in parallel
+        with ThreadPoolExecutor(max_workers=len(WORKFLOW_STATUSES)) as pool:
+            counts = pool.map(get_merge_queue_runs_count_by_status, WORKFLOW_STATUSES)
+        for status, count in zip(WORKFLOW_STATUSES, counts):
+            log.info("%s runs: %s", status, count)
             labels = {"status": status, "workflow_file": WORKFLOW_FILE}
-            push_metric_to_victoriametrics(now, "workflow_runs_count", count, labels=labels)
+            lines.append(render_metric_line("workflow_runs_count", count, now, labels=labels))
 
-        for run in fetch_all_runs(max_runs=100):
-            timestamp = int(run["created_at"].timestamp() * 1000)
-            metric_value = run["duration_seconds"]
-            run_id = str(run["id"])
+        created_after = cursor - CURSOR_LOOKBACK * 1000 if cursor is not None else None
+        newest = cursor
+        for run in fetch_all_runs(max_runs=100, created_after=created_after):
+            updated_at = run["updated_at"]
 
-            if run_id in processed_runs:
+            if cursor is not None and updated_at <= cursor:
                 continue
-            processed_runs.add(run_id)
-
-            labels = {"workflow_file": WORKFLOW_FILE}
-            exemplar = {"run_id": run_id}
-            push_metric_to_victoriametrics(
-                timestamp,
-                "workflow_runs_duration_seconds",
-                metric_value,
-                labels=labels,
-                exemplar=exemplar
-            )
+            if newest is None or updated_at > newest:
+                newest = updated_at
+
+            lines.append(render_run_duration(run["duration_seconds"], run["created_at"], str(run["id"])))
+
+        # Only advance the cursor once the runs are stored, so a failed push
+        # is retried on the next poll
+        if flush_batch(lines) and newest != cursor:
+            cursor = newest
+            save_cursor(cursor)
 
         time.sleep(POLL_INTERVAL)
 
 
 def main():
     """Main function to push workflow metrics."""
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
     if "--backfill" in sys.argv:
         backfill_runs(count=BACKFILL_COUNT)
     push_metrics()
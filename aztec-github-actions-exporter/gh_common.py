@@ -0,0 +1,315 @@
+"""
+Shared GitHub Actions API client for the merge queue workflow.
+
+Used by both the metrics exporter and gh-ci-analyzer.
+"""
+import calendar
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import ijson
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+OWNER = "AztecProtocol"
+REPO = "aztec-packages"
+WORKFLOW_FILE = "ci3.yml"
+GITHUB_API = "https://api.github.com"
+
+# Number of GitHub pages fetched ahead when listing runs without a cutoff
+PREFETCH_PAGES = 4
+
+log = logging.getLogger(__name__)
+
+# Headers for GitHub API requests, built once and set as session defaults
+GITHUB_HEADERS = {"Accept": "application/vnd.github+json"}
+_github_token = os.environ.get("GITHUB_TOKEN")
+if _github_token:
+    GITHUB_HEADERS["Authorization"] = f"Bearer {_github_token}"
+
+
+def create_session(headers: dict[str, str] | None = None) -> requests.Session:
+    """
+    Create a session that keeps connections alive and retries transient errors.
+
+    Reusing the session avoids a new TCP+TLS handshake for every request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=32,
+        max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504]),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+class RateLimiter:
+    """
+    Pace GitHub requests using the X-RateLimit-* headers of previous responses.
+
+    Every request consumes a token from the remaining budget reported by
+    GitHub. When it drops below min_remaining, acquire() blocks until the
+    window resets instead of running into 403 responses.
+    """
+
+    def __init__(self, min_remaining: int = 50):
+        self.min_remaining = min_remaining
+        self._remaining: int | None = None
+        self._reset = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        with self._lock:
+            if self._remaining is None:
+                return
+            if self._remaining < self.min_remaining:
+                wait = self._reset - time.time()
+                if wait > 0:
+                    log.warning("GitHub rate limit nearly exhausted, sleeping %.0fs until reset", wait)
+                    time.sleep(wait)
+                # Unknown until the next response reports the new window
+                self._remaining = None
+                return
+            self._remaining -= 1
+
+    def update(self, response: requests.Response):
+        """Refill the budget from the rate limit headers of a response."""
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            self._remaining = int(remaining)
+            self._reset = float(reset)
+
+
+GH_SESSION = create_session(GITHUB_HEADERS)
+GH_RATE_LIMITER = RateLimiter()
+
+
+# Conditional request cache: (url, params) -> (ETag, response JSON)
+_etag_cache: dict[tuple, tuple[str, Any]] = {}
+
+
+def load_json(response: requests.Response) -> Any:
+    """Decode a whole JSON response body."""
+    return orjson.loads(response.content)
+
+
+def get_github_json(
+    url: str,
+    params: dict,
+    use_etag: bool = True,
+    parse: Callable[[requests.Response], Any] = load_json,
+) -> Any:
+    """
+    GET a GitHub API resource, revalidating cached responses with If-None-Match.
+
+    A 304 Not Modified reply has no body and does not count against the
+    primary rate limit, so unchanged resources are served from the cache.
+    The response is streamed; parse decides how much of the body to keep.
+    """
+    key = (url, tuple(sorted(params.items())))
+    cached = _etag_cache.get(key) if use_etag else None
+    headers = {"If-None-Match": cached[0]} if cached else None
+
+    GH_RATE_LIMITER.acquire()
+    with GH_SESSION.get(url, params=params, headers=headers, stream=True) as response:
+        GH_RATE_LIMITER.update(response)
+        if cached and response.status_code == 304:
+            return cached[1]
+        response.raise_for_status()
+        data = parse(response)
+
+    etag = response.headers.get("ETag")
+    if use_etag and etag:
+        _etag_cache[key] = (etag, data)
+    return data
+
+
+def get_merge_queue_runs_count_by_status(status: str | None = "completed") -> int:
+    """Get the count of merge queue runs by status, or of all runs if status is None."""
+    url = f"{GITHUB_API}/repos/{OWNER}/{REPO}/actions/workflows/{WORKFLOW_FILE}/runs"
+    params = {
+        "event": "merge_group",
+        # Only total_count is needed, so don't transfer a page of runs with it
+        "per_page": 1,
+        "exclude_pull_requests": "true",
+    }
+    if status:
+        params["status"] = status
+    return get_github_json(url, params)["total_count"]
+
+
+# Run fields read by parse_run_data and gh-ci-analyzer; everything else is dropped
+RUN_FIELDS = (
+    "id",
+    "run_number",
+    "event",
+    "status",
+    "conclusion",
+    "created_at",
+    "updated_at",
+    "html_url",
+    "head_branch",
+    "head_sha",
+)
+
+
+def load_runs(response: requests.Response) -> list[dict]:
+    """
+    Stream the `workflow_runs` array of a response, keeping only RUN_FIELDS.
+
+    Only one full run is materialized at a time instead of the whole page.
+    """
+    response.raw.decode_content = True
+    return [
+        {field: run.get(field) for field in RUN_FIELDS}
+        for run in ijson.items(response.raw, "workflow_runs.item")
+    ]
+
+
+def get_merge_queue_runs(per_page: int = 30, page: int = 1, status: str | None = "completed") -> list[dict]:
+    """
+    Fetch workflow runs triggered by merge_group events.
+
+    Pass status=None to list runs in any state.
+
+    GitHub API: GET /repos/{owner}/{repo}/actions/workflows/{workflow_id}/runs
+    Docs: https://docs.github.com/en/rest/actions/workflow-runs#list-workflow-runs-for-a-workflow
+    """
+    url = f"{GITHUB_API}/repos/{OWNER}/{REPO}/actions/workflows/{WORKFLOW_FILE}/runs"
+    params = {
+        "event": "merge_group",
+        "per_page": per_page,
+        "page": page,
+        # The pull_requests arrays are never read
+        "exclude_pull_requests": "true",
+    }
+    if status:
+        params["status"] = status
+
+    # Only the first page is polled repeatedly; caching deeper backfill
+    # pages would hold their runs in memory for no benefit.
+    return get_github_json(url, params, use_etag=page == 1, parse=load_runs)
+
+
+def parse_gh_ts(ts: str) -> int:
+    """Convert a GitHub `YYYY-MM-DDTHH:MM:SSZ` timestamp to milliseconds since epoch."""
+    return calendar.timegm((
+        int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+        int(ts[11:13]), int(ts[14:16]), int(ts[17:19]),
+        0, 0, 0,
+    )) * 1000
+
+
+def parse_run_data(run: dict) -> dict:
+    """Extract relevant fields from a workflow run. Timestamps are in milliseconds since epoch."""
+    created_at = parse_gh_ts(run["created_at"])
+    updated_at = parse_gh_ts(run["updated_at"])
+
+    # Duration is from creation to completion
+    duration_seconds = (updated_at - created_at) / 1000
+
+    return {
+        "id": run["id"],
+        "run_number": run["run_number"],
+        "status": run["status"],  # queued, in_progress, completed
+        "conclusion": run["conclusion"],  # success, failure, cancelled, etc.
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "duration_seconds": duration_seconds,
+        "duration_minutes": duration_seconds / 60,
+        "html_url": run["html_url"],
+        "head_branch": run["head_branch"],
+        "head_sha": run["head_sha"][:8],
+    }
+
+
+def iter_runs(
+    max_runs: int = 100,
+    created_after: int | None = None,
+    status: str | None = "completed",
+) -> Iterator[dict]:
+    """
+    Yield raw workflow runs, newest first, across pages up to max_runs.
+
+    If created_after (milliseconds since epoch) is given, stop at the first
+    run created before it.
+
+    Without created_after, up to PREFETCH_PAGES pages are requested ahead
+    while earlier pages are consumed; runs are still yielded in order. The
+    number of pages is bounded by the listing's total_count so prefetching
+    never requests pages past the end.
+    """
+    if max_runs <= 0:
+        return
+
+    remaining_runs = max_runs
+    per_page = min(100, max_runs)  # GitHub max is 100 per page
+    total_pages = math.ceil(max_runs / per_page)
+    # Pages past an early stop would be wasted requests, so don't prefetch then
+    prefetch = min(PREFETCH_PAGES, total_pages) if created_after is None else 1
+    if prefetch > 1:
+        # Requests already in flight can't be cancelled, so bound the listing by
+        # its actual size instead of running into the end with prefetched pages
+        total_count = get_merge_queue_runs_count_by_status(status)
+        total_pages = min(total_pages, max(1, math.ceil(total_count / per_page)))
+        prefetch = min(prefetch, total_pages)
+
+    def fetch_page(page: int) -> list[dict]:
+        return get_merge_queue_runs(per_page=per_page, page=page, status=status)
+
+    pool = ThreadPoolExecutor(max_workers=prefetch)
+    try:
+        pending = deque(pool.submit(fetch_page, page) for page in range(1, prefetch + 1))
+        next_page = prefetch + 1
+
+        while pending and remaining_runs:
+            runs = pending.popleft().result()
+
+            if not runs:
+                break
+
+            # A short page is the last one, so only keep prefetching after full pages
+            if len(runs) == per_page and next_page <= total_pages:
+                pending.append(pool.submit(fetch_page, next_page))
+                next_page += 1
+
+            for run in runs:
+                if remaining_runs <= 0:
+                    break
+                if created_after is not None and parse_gh_ts(run["created_at"]) < created_after:
+                    return
+                yield run
+                remaining_runs -= 1
+
+            # A short page is the last one
+            if len(runs) < per_page:
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_all_runs(
+    max_runs: int = 100,
+    created_after: int | None = None,
+    status: str | None = "completed",
+) -> Iterator[dict]:
+    """Fetch multiple pages of runs up to max_runs, parsed with parse_run_data."""
+    for run in iter_runs(max_runs, created_after=created_after, status=status):
+        yield parse_run_data(run)
@@ -5,121 +5,62 @@ This demonstrates that the required data is accessible programmatically.
 """
 
 import os
-from datetime import datetime
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
 from pprint import pprint
 
-import requests
+import numpy as np
 
-# Configuration
-OWNER = "AztecProtocol"
-REPO = "aztec-packages"
-WORKFLOW_FILE = "ci3.yml"
-GITHUB_API = "https://api.github.com"
+# The GitHub client is shared with the exporter, which lives in a sibling directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "aztec-github-actions-exporter"))
 
+from gh_common import OWNER, REPO, WORKFLOW_FILE, iter_runs, parse_run_data  # noqa: E402
 
-def get_headers():
-    """Get headers for GitHub API requests."""
-    headers = {"Accept": "application/vnd.github+json"}
-    token = os.environ.get("GITHUB_TOKEN")
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-    return headers
-
-
-def get_merge_queue_runs(per_page: int = 30, page: int = 1) -> dict:
-    """
-    Fetch workflow runs triggered by merge_group events.
-
-    GitHub API: GET /repos/{owner}/{repo}/actions/workflows/{workflow_id}/runs
-    Docs: https://docs.github.com/en/rest/actions/workflow-runs#list-workflow-runs-for-a-workflow
-    """
-    url = f"{GITHUB_API}/repos/{OWNER}/{REPO}/actions/workflows/{WORKFLOW_FILE}/runs"
-    params = {
-        "event": "merge_group",
-        "per_page": per_page,
-        "page": page,
-    }
-
-    response = requests.get(url, headers=get_headers(), params=params)
-    response.raise_for_status()
-    return response.json()
-
-
-def parse_run_data(run: dict) -> dict:
-    """Extract relevant fields from a workflow run."""
-    created_at = datetime.fromisoformat(run["created_at"].replace("Z", "+00:00"))
-    updated_at = datetime.fromisoformat(run["updated_at"].replace("Z", "+00:00"))
-
-    # Duration is from creation to completion
-    duration_seconds = (updated_at - created_at).total_seconds()
 
+def run_columns(raw_runs: list[dict]) -> dict[str, np.ndarray]:
+    """Pull the fields used by calculate_stats out of raw runs into parallel arrays."""
+    # GitHub timestamps are UTC; drop the "Z" so numpy parses them as naive datetimes
+    created_at = np.array([r["created_at"][:-1] for r in raw_runs], dtype="datetime64[s]")
+    updated_at = np.array([r["updated_at"][:-1] for r in raw_runs], dtype="datetime64[s]")
     return {
-        "id": run["id"],
-        "run_number": run["run_number"],
-        "status": run["status"],  # queued, in_progress, completed
-        "conclusion": run["conclusion"],  # success, failure, cancelled, etc.
-        "created_at": created_at,
-        "updated_at": updated_at,
-        "duration_seconds": duration_seconds,
-        "duration_minutes": duration_seconds / 60,
-        "html_url": run["html_url"],
-        "head_branch": run["head_branch"],
-        "head_sha": run["head_sha"][:8],
+        "status": np.array([r["status"] for r in raw_runs]),
+        "conclusion": np.array([r["conclusion"] for r in raw_runs], dtype=object),
+        # Duration is from creation to completion
+        "duration_minutes": (updated_at - created_at).astype(np.float64) / 60,
     }
 
 
-def fetch_all_runs(max_runs: int = 100) -> list[dict]:
-    """Fetch multiple pages of runs up to max_runs."""
-    all_runs = []
-    page = 1
-    per_page = min(100, max_runs)  # GitHub max is 100 per page
-
-    while len(all_runs) < max_runs:
-        data = get_merge_queue_runs(per_page=per_page, page=page)
-        runs = data.get("workflow_runs", [])
-
-        if not runs:
-            break
-
-        all_runs.extend(runs)
-        page += 1
-
-        # Check if we've fetched all available runs
-        if len(runs) < per_page:
-            break
-
-    return all_runs[:max_runs]
-
-
-def calculate_stats(parsed_runs: list[dict]) -> dict:
-    """Calculate basic statistics from parsed runs."""
-    if not parsed_runs:
+def calculate_stats(runs: dict[str, np.ndarray]) -> dict:
+    """Calculate basic statistics from the columns built by run_columns."""
+    statuses = runs["status"]
+    if not statuses.size:
         return {}
 
     # Filter completed runs
-    completed = [r for r in parsed_runs if r["status"] == "completed"]
+    completed = statuses == "completed"
+    completed_count = int(completed.sum())
 
     # Failure rate
-    failures = [r for r in completed if r["conclusion"] == "failure"]
-    failure_rate = len(failures) / len(completed) if completed else 0
+    failures = int(np.sum(completed & (runs["conclusion"] == "failure")))
+    failure_rate = failures / completed_count if completed_count else 0
 
     # Duration stats (only for completed runs)
-    durations = sorted([r["duration_minutes"] for r in completed])
-
-    def percentile(data: list, p: int) -> float:
-        if not data:
-            return 0
-        idx = int(len(data) * p / 100)
-        return data[min(idx, len(data) - 1)]
+    completed_durations = runs["duration_minutes"][completed]
+    if completed_durations.size:
+        p50, p95 = np.percentile(completed_durations, [50, 95])
+        duration_max = completed_durations.max()
+    else:
+        p50 = p95 = duration_max = 0
 
     return {
-        "total_runs": len(parsed_runs),
-        "completed_runs": len(completed),
-        "failures": len(failures),
+        "total_runs": int(statuses.size),
+        "completed_runs": completed_count,
+        "failures": failures,
         "failure_rate": f"{failure_rate:.1%}",
-        "duration_p50_minutes": round(percentile(durations, 50), 1),
-        "duration_p95_minutes": round(percentile(durations, 95), 1),
-        "duration_max_minutes": round(max(durations) if durations else 0, 1),
+        "duration_p50_minutes": round(float(p50), 1),
+        "duration_p95_minutes": round(float(p95), 1),
+        "duration_max_minutes": round(float(duration_max), 1),
     }
 
 
@@ -136,28 +77,26 @@ def main():
         print("Set GITHUB_TOKEN env var for higher rate limits.\n")
 
     # Fetch a sample of runs
-    raw_runs = fetch_all_runs(max_runs=50)
+    raw_runs = list(iter_runs(max_runs=50, status=None))
     print(f"\nFetched {len(raw_runs)} workflow runs\n")
 
     if not raw_runs:
         print("No merge queue runs found!")
         return
 
-    # Parse the data
-    parsed_runs = [parse_run_data(run) for run in raw_runs]
-
-    # Show sample of recent runs
+    # Show sample of recent runs; only these few are parsed row by row
     print("Recent merge queue runs:")
     print("-" * 60)
-    for run in parsed_runs[:5]:
+    for run in map(parse_run_data, raw_runs[:5]):
+        created_date = datetime.fromtimestamp(run["created_at"] / 1000, tz=timezone.utc).date()
         print(f"  #{run['run_number']} | {run['conclusion']:10} | "
-              f"{run['duration_minutes']:.1f} min | {run['created_at'].date()}")
+              f"{run['duration_minutes']:.1f} min | {created_date}")
 
     # Calculate and display stats
     print("\n" + "=" * 60)
     print("STATISTICS (from fetched sample)")
     print("=" * 60)
-    stats = calculate_stats(parsed_runs)
+    stats = calculate_stats(run_columns(raw_runs))
     for key, value in stats.items():
         print(f"  {key}: {value}")
 